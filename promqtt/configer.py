@@ -3,29 +3,38 @@ dict structure with configuration values populated from command-line,
 environment variables and possibly a configiration file.'''
 
 import argparse
-import os
 
-def _set_struct(cfg, name, value, sep='.'):
-    '''Parses a "path" string to locate the specified path in a dictionary to 
-    set a value. 
+def _compile_cfgdef(cfgdef, sep='.'):
+    '''Prepare the config specification for evaluation. The "path" strings are
+    split only once here instead of for every config source.
 
-    E.g. name='root.sub.val', value=foo => {'root': {'sub': {'val': 'foo'}}}'''
-    
-    parts = name.split(sep)
+    :returns: List of (name, parts, type, default, env var name) tuples.'''
+
+    return [
+        (
+            name,
+            tuple(name.split(sep)),
+            info['type'],
+            info['default'],
+            name.upper().replace(sep, '_'))
+        for name, info in cfgdef.items()]
+
+
+def _set_struct(cfg, parts, value):
+    '''Use the parts of a (split) "path" string to locate the specified path in a
+    dictionary to set a value. 
 
+    E.g. parts=('root', 'sub', 'val'), value=foo => 
+    {'root': {'sub': {'val': 'foo'}}}'''
+    
     # loop over all but last part
     for part in parts[:-1]:
-        if part not in cfg:
-            cfg[part] = {}
-
-        cfg = cfg[part]
+        cfg = cfg.setdefault(part, {})
                     
     cfg[parts[-1]] = value
 
 
-def _get_struct(cfg, name, sep='.', default=None):
-    parts = name.split(sep)
-    
+def _get_struct(cfg, parts):
     for part in parts:
         if part in cfg:
             cfg = cfg[part]
@@ -50,36 +59,37 @@ def prepare_argparser(cfgdef, parser=None):
     return parser
 
 
-def eval_args(cfgdef, cfg, args):
+def eval_args(cfgitems, cfg, args):
     argvars = vars(args)
     
-    for name, info in cfgdef.items():
+    for name, parts, typ, default, varname in cfgitems:
         if (name in argvars) and (argvars[name] is not None):
-            _set_struct(cfg, name, argvars[name])
+            _set_struct(cfg, parts, argvars[name])
 
 
-def eval_env(cfgdef, cfg, env):
-    for name, info in cfgdef.items():
-        varname = name.upper().replace('.', '_')
+def eval_env(cfgitems, cfg, env):
+    for name, parts, typ, default, varname in cfgitems:
         if varname in env:
-            _set_struct(cfg, name, info['type'](os.environ[varname]))
+            _set_struct(cfg, parts, typ(env[varname]))
 
 
-def eval_cfgfile_data(cfgdef, cfg, cfg_in):
-    for name, item in cfgdef.items():
-        v = _get_struct(cfg_in, name)
+def eval_cfgfile_data(cfgitems, cfg, cfg_in):
+    for name, parts, typ, default, varname in cfgitems:
+        v = _get_struct(cfg_in, parts)
         if v != None:
-            _set_struct(cfg, name, v)
+            _set_struct(cfg, parts, v)
 
             
 def eval_cfg(cfgdef, cfg_in, env, args):
     cfg = {}
 
-    for name, item in cfgdef.items():
-        _set_struct(cfg, name, item['default'])
+    cfgitems = _compile_cfgdef(cfgdef)
+
+    for name, parts, typ, default, varname in cfgitems:
+        _set_struct(cfg, parts, default)
     
-    eval_cfgfile_data(cfgdef, cfg, cfg_in)
-    eval_env(cfgdef, cfg, env)
-    eval_args(cfgdef, cfg, args)
+    eval_cfgfile_data(cfgitems, cfg, cfg_in)
+    eval_env(cfgitems, cfg, env)
+    eval_args(cfgitems, cfg, args)
 
     return cfg
@@ -2,6 +2,7 @@
 and other preprocessing steps.'''
 
 from copy import deepcopy
+from string import Formatter
 
 
 def _push_dev_settings_to_channels(devs):
@@ -54,6 +55,33 @@ def _split_topics(devs):
         for ch in dev['channels'].values():
             ch['topic'] = ch['topic'].split('/')
     
+
+
+def _is_literal(fmt):
+    '''Check if a format string has no replacement fields, i.e. always formats
+    to the same string.'''
+
+    return all(
+        field is None for literal, field, spec, conv in Formatter().parse(fmt))
+
+
+def _sort_label_names(devs):
+    '''If all label names of a channel are constant, sort them only once here 
+    and keep the label value format strings in the same order.'''
+
+    for devname, dev in devs.items():
+        for ch in dev['channels'].values():
+            labels = ch.get('labels', {})
+
+            if all(_is_literal(k) for k in labels):
+                labels = sorted((k.format(), v) for k, v in labels.items())
+
+                ch['_label_keys'] = tuple(k for k, v in labels)
+                ch['_label_val_fmts'] = tuple(v for k, v in labels)
+            else:
+                ch['_label_keys'] = None
+                ch['_label_val_fmts'] = None
+
                                     
 def prepare_devices(dev_cfg):
     '''Preprocess devices, i.e. apply type inheritance, push device settings 
@@ -75,3 +103,6 @@ def prepare_devices(dev_cfg):
 
     # split topic strings
     _split_topics(dev_cfg['devices'])
+
+    # sort constant label names
+    _sort_label_names(dev_cfg['devices'])
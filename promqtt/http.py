@@ -12,7 +12,13 @@ class PromHttpRequestHandler(BaseHTTPRequestHandler):
             self.send_header('Content-type', route['type'])
             self.end_headers()
             
-            self.wfile.write(route['fct']().encode('utf-8'))
+            data = route['fct']()
+
+            # route functions may already provide encoded data
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+
+            self.wfile.write(data)
         else:
             self.send_response(404)
             self.end_headers()
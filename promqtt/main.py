@@ -3,7 +3,6 @@ import json
 import logging
 import os
 import signal
-import sys
 
 from ruamel.yaml import YAML
 
@@ -45,7 +44,7 @@ def export_build_info(pe, title, version):
     pe.set(
         name='tasmota_build_info',
         value='1',
-        labels={'version': version})
+        labels=(('version', version),))
 
     
 def setup_logging(verbose):
@@ -83,7 +82,7 @@ def main():
     routes = {
         '/metrics': {
             'type': 'text/plain',
-            'fct': pe.render
+            'fct': pe.render_bytes
         },
         '/cfg_json': {
             'type': 'application/json',
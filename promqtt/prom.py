@@ -1,6 +1,7 @@
-from datetime import datetime
+from functools import lru_cache
 import logging
-from threading import Thread, Lock
+from threading import Lock
+import time
 
 
 class PrometheusExporterException(Exception):
@@ -9,6 +10,103 @@ class PrometheusExporterException(Exception):
     pass
 
 
+@lru_cache(maxsize=4096)
+def _item_name(name, labels):
+    '''Format the item name from measurement name and labels. Cached, so that
+    repeated updates of the same item do not need to format the name again. The
+    size is limited, as label values can change over time (e.g. node names).'''
+
+    labelstr = ','.join(
+        '{0}="{1}"'.format(k, v) for k, v in labels)
+
+    return '{name}{{{labels}}}'.format(
+        name=name,
+        labels=labelstr)
+
+
+class Measurement():
+    '''Data of one registered measurement. The items are stored in parallel
+    lists (item names, encoded output lines and timestamps) to keep the per-item
+    overhead low. `index` maps an item name to its position in these lists.'''
+
+    __slots__ = (
+        'timeout', 'header', 'names', 'lines', 'timestamps', 'index')
+
+    def __init__(self, name, helpstr, datatype, timeout):
+        self.timeout = timeout
+
+        # help and type lines of the output
+        self.header = '# HELP {0} {1}\n# TYPE {0} {2}'.format(
+            name, helpstr, datatype).encode('utf-8')
+
+        self.names = []
+        self.lines = []
+        self.timestamps = []
+        self.index = {}
+
+
+    def set_item(self, name, line, timestamp):
+        '''Set the UTF-8 encoded output line (item name and value) and timestamp
+        of an item. The item is added if it does not exist yet.'''
+
+        pos = self.index.get(name)
+
+        if pos is None:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+            self.lines.append(line)
+            self.timestamps.append(timestamp)
+        else:
+            self.lines[pos] = line
+            self.timestamps[pos] = timestamp
+
+
+    def remove_item(self, name):
+        '''Remove an item. The last item is moved to the free position, so the
+        lists stay compact.
+
+        :returns: True if the item was removed, False if it did not exist.'''
+
+        pos = self.index.pop(name, None)
+
+        if pos is None:
+            return False
+
+        last_name = self.names.pop()
+        last_line = self.lines.pop()
+        last_timestamp = self.timestamps.pop()
+
+        if last_name != name:
+            self.names[pos] = last_name
+            self.lines[pos] = last_line
+            self.timestamps[pos] = last_timestamp
+            self.index[last_name] = pos
+
+        return True
+
+
+    def remove_older(self, cutoff):
+        '''Remove all items with a timestamp not newer than `cutoff`.
+
+        :returns: List with the names of the removed items.'''
+
+        keep = [i for i, ts in enumerate(self.timestamps) if ts > cutoff]
+
+        if len(keep) == len(self.names):
+            return []
+
+        removed = [
+            name for name, ts in zip(self.names, self.timestamps)
+            if ts <= cutoff]
+
+        self.names = [self.names[i] for i in keep]
+        self.lines = [self.lines[i] for i in keep]
+        self.timestamps = [self.timestamps[i] for i in keep]
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+        return removed
+
+
 class PrometheusExporter():
     '''Manage all measurements and provide the htp interface for interfacing with
     Prometheus.'''
@@ -17,6 +115,12 @@ class PrometheusExporter():
         self._prom = {}
         self._lock = Lock()
 
+        # cached output of `render_bytes()`, reset to None whenever data
+        # changes. Readers access the cache without taking the lock, as long as
+        # no item can have timed out (i.e. before `_next_timeout`).
+        self._cache = None
+        self._next_timeout = float('inf')
+
         
     def register(self, name, datatype, helpstr, timeout=None):
         '''Register a name for exporting. This must be called before calling 
@@ -31,11 +135,11 @@ class PrometheusExporter():
         
         with self._lock:
             if name not in self._prom:
-                self._prom[name] = {
-                    'help': helpstr,
-                    'type': datatype,
-                    'data':{},
-                    'timeout': timeout}
+                self._prom[name] = Measurement(
+                    name=name,
+                    helpstr=helpstr,
+                    datatype=datatype,
+                    timeout=timeout)
             else:
                 raise PrometheusExporterException(
                     'Measurement already registered')
@@ -46,104 +150,129 @@ class PrometheusExporter():
 
         :param str name: The name of the value to set. This name must have been 
           registered already by calling `register()`.
-        :param dict labels: The labels to attach to this name.
+        :param tuple labels: The labels to attach to this name as tuple of 
+          (name, value) tuples, sorted by name.
         :param value: The value to set. Automatically converted to string.
         :param fmt: The string format to use to convert value to a string. 
           Default: '{0}'. '''
 
-        labelstr = ','.join(
-            ['{0}="{1}"'.format(k, labels[k]) for k in sorted(labels.keys())]
-        )
-        
-        if name not in self._prom:
+        meas = self._prom.get(name)
+
+        if meas is None:
             msg = "Cannot set not registered measurement '{0}'."
             logging.error(msg.format(name))
             return
 
-        namestr = '{name}{{{labels}}}'.format(
-            name=name,
-            labels=labelstr)
-            
-        with self._lock:
-            data = self._prom[name]['data']
+        namestr = _item_name(name, labels)
 
+        with self._lock:
             if value is not None:
-                data[namestr] = {'value': fmt.format(value)}
-                data[namestr]['timestamp'] = self._get_time()
+                now = self._get_time()
+                line = namestr + ' ' + fmt.format(value)
+                meas.set_item(namestr, line.encode('utf-8'), now)
+
+                if meas.timeout is not None:
+                    self._next_timeout = min(
+                        self._next_timeout, now + meas.timeout)
             else:
                 # we remove the item when passing None as value 
-                if namestr in data:
-                    del data[namestr]
+                meas.remove_item(namestr)
+
+            self._cache = None
 
         logging.debug('Set prom value {0} = {1}'.format(
             namestr, value))
 
         
     def _get_time(self):
-        '''Return the current time as a datetime object. 
+        '''Return the current time in seconds from a monotonic clock.
 
         Wrapped in a function, so it can be stubbed for testing.'''
         
-        return datetime.now()
+        return time.monotonic()
         
         
     def _check_timeout(self):
         '''Remove all data which has timed out (i.e. is not valid anymore).'''
-        to_delete = []
+
+        now = self._get_time()
+
+        if now < self._next_timeout:
+            return
+
+        next_timeout = float('inf')
 
         # loop over all measurements
         for meas in self._prom.values():
-            to = meas['timeout']
+            to = meas.timeout
 
             if to == None:
                 continue
-            
-            data = meas['data']
-            now = self._get_time()
-
-            # first loop to find timed out items
-            for item_name, item in data.items():
-                if (now - item['timestamp']).total_seconds() >= to:
-                    to_delete.append(item_name)
-
-            # second loop to remove them
-            for item_name in to_delete:
-                del data[item_name]
-                msg = "Removed timed out item '{0}'."
-                logging.debug(msg.format(item_name))
-                    
-            to_delete.clear()
+
+            removed = meas.remove_older(now - to)
+
+            if removed:
+                for item_name in removed:
+                    msg = "Removed timed out item '{0}'."
+                    logging.debug(msg.format(item_name))
+
+                self._cache = None
+
+            if meas.timestamps:
+                next_timeout = min(next_timeout, min(meas.timestamps) + to)
+
+        self._next_timeout = next_timeout
 
         
+    def _update_cache(self):
+        '''Remove timed out items and rebuild the cached output if the data
+        changed since the last call. Must be called with the lock held.'''
+
+        self._check_timeout()
+
+        if self._cache is not None:
+            return
+
+        lines = []
+        append = lines.append
+        extend = lines.extend
+
+        for meas in self._prom.values():
+            # do not output items without values
+            if len(meas.names) == 0:
+                continue
+
+            append(meas.header)
+            extend(meas.lines)
+
+        self._cache = b'\n'.join(lines)
+
+
     def render(self):
         '''Render the current data to Prometheus format. See 
         https://prometheus.io/docs/instrumenting/exposition_formats/ for details.
 
         :returns: String with output suitable for consumption by Prometheus over 
           HTTP. '''
-        
-        lines = []
 
-        with self._lock:
+        return self.render_bytes().decode('utf-8')
 
-            self._check_timeout()
-            
-            for k in self._prom.keys():
-                data = self._prom[k]['data']
-                            
-                # do not output items without values
-                if len(self._prom[k]['data']) == 0:
-                       continue
-                
-                lines.append('# HELP {k} {h}'.format(
-                    k=k,
-                    h=self._prom[k]['help']))
-                lines.append('# TYPE {k} {t}'.format(
-                    k=k,
-                    t=self._prom[k]['type']))
-        
-                for i in data.keys():
-                    lines.append('{n} {v}'.format(
-                        n=i, v=data[i]['value']))
-    
-        return '\n'.join(lines)
+
+    def render_bytes(self):
+        '''Render the current data like `render()`, but return the UTF-8 encoded
+        output. The item lines are already stored encoded, so the output is 
+        built as bytes directly and the http server does not need to encode it.
+
+        The output is cached and only rebuilt after the data changed.
+
+        :returns: Bytes with output suitable for sending to Prometheus over
+          HTTP. '''
+
+        cache = self._cache
+
+        if (cache is None) or (self._get_time() >= self._next_timeout):
+            with self._lock:
+                self._update_cache()
+                cache = self._cache
+
+        return cache
@@ -1,9 +1,27 @@
-import json
+from functools import lru_cache
 import logging
+from operator import itemgetter
+from queue import Queue
+from threading import Thread
+
+# use the faster orjson parser if available
+try:
+    import orjson as json
+except ImportError:
+    import json
 
 import paho.mqtt.client as mqtt
 from promqtt.device_loader import prepare_devices
 
+
+@lru_cache(maxsize=4096)
+def _split_topic(topic):
+    '''Split a MQTT topic into a tuple of its parts. Cached, as devices send
+    messages with the same topics over and over again.'''
+
+    return tuple(topic.split('/'))
+
+
 class TasmotaMQTTClient():
     def __init__(self, prom_exp, mqtt_cfg, cfg):
         self._prom_exp = prom_exp
@@ -13,6 +31,21 @@ class TasmotaMQTTClient():
         prepare_devices(cfg)
             
         self._register_measurements()
+
+        self._build_topic_tree()
+
+        # messages are handled in a worker thread, so that the MQTT client can
+        # keep receiving. A single worker keeps the messages in order, so an
+        # older value never overwrites a newer one. The queue is limited, so
+        # when the worker falls behind, the MQTT client blocks instead of
+        # queueing up messages without limit.
+        self._queue = Queue(maxsize=1000)
+
+        worker = Thread(
+            target=self._run_worker,
+            name='mqtt_handler',
+            daemon=True)
+        worker.start()
         
         msg = 'Connecting to MQTT broker at {broker}:{port}.'
         logging.info(msg.format(**mqtt_cfg))
@@ -50,41 +83,100 @@ class TasmotaMQTTClient():
                 timeout=meas['timeout'] if meas['timeout'] else None)
         
     
-    def _is_topic_matching(self, ch_topic, msg_topic):
-        '''Check if the msg_topic (already split as list) matches the ch_topic (also
-        split as list).'''
-        
-        if len(ch_topic) != len(msg_topic):
-            return False
-        
-        result = all(
-            ((part=='+') or (part==msg_topic[i]))
-            for i, part in enumerate(ch_topic))
+    def _build_topic_tree(self):
+        '''Build a tree from the topics of all channels for dispatching incoming 
+        messages. Each level maps a topic part (or the '+' wildcard) to the next 
+        level. The (number, device, channel) tuples of a topic are stored in the
+        last level with key None. The number is the position of the channel in 
+        the configuration.'''
+
+        self._topic_tree = {}
+        num = 0
+
+        for dev in self._cfg['devices'].values():
+            for ch in dev['channels'].values():
+                node = self._topic_tree
+
+                for part in ch['topic']:
+                    node = node.setdefault(part, {})
+
+                node.setdefault(None, []).append((num, dev, ch))
+                num += 1
+
+        # first topic parts of all channels to reject messages for unrelated
+        # topics without splitting the topic. None if any channel topic starts
+        # with a wildcard.
+        if '+' in self._topic_tree:
+            self._topic_roots = None
+        else:
+            self._topic_roots = frozenset(self._topic_tree)
+
+
+    def _find_channels(self, topic):
+        '''Find all channels with a topic matching the message topic (already 
+        split into its parts).
+
+        :returns: List of (device, channel) tuples in the order of the 
+          configuration.'''
+
+        result = []
+        depth = len(topic)
+        stack = [(self._topic_tree, 0)]
+
+        while stack:
+            node, i = stack.pop()
+
+            if i == depth:
+                result.extend(node.get(None, ()))
+                continue
+
+            for part in (topic[i], '+'):
+                child = node.get(part)
+                if child is not None:
+                    stack.append((child, i + 1))
+
+        # exact and wildcard matches are found in any order, so restore the
+        # order of the configuration
+        result.sort(key=itemgetter(0))
 
-        return result
+        return [(dev, ch) for num, dev, ch in result]
 
     
     def on_mqtt_msg(self, client, obj, msg):
         '''Handle incoming MQTT message.'''
 
+        if ((self._topic_roots is not None)
+                and (msg.topic.partition('/')[0] not in self._topic_roots)):
+            return
+
+        self._queue.put(msg)
+
+
+    def _run_worker(self):
+        '''Handle the queued MQTT messages. This function does not return.'''
+
+        while True:
+            self._handle_msg(self._queue.get())
+
+
+    def _handle_msg(self, msg):
+        '''Dispatch a MQTT message to all channels with matching topic. Called 
+        in the worker thread.'''
+
         try:
+            topic = _split_topic(msg.topic)
+            channels = self._find_channels(topic)
+
+            if not channels:
+                return
+
             msg_data = {
                 'raw_topic': msg.topic,
                 'raw_payload': msg.payload,
-                'topic': msg.topic.split('/'),
+                'topic': topic,
             }
         
-            for dev in self._cfg['devices'].values():
-                self._handle_device(dev, msg_data)
-                
-        except Exception as ex:
-            logging.exception('fail')
-            print(ex)
-
-            
-    def _handle_device(self, dev, msg_data):
-        for ch in dev['channels'].values():
-            if self._is_topic_matching(ch['topic'], msg_data['topic']):
+            for dev, ch in channels:
                 try:
                     self._handle_channel(dev, ch, msg_data)
                 except Exception as ex:
@@ -92,19 +184,30 @@ class TasmotaMQTTClient():
                     logging.exception(msg.format(
                         dev=dev['_dev_name'],
                         ch=ch['_ch_name']))
+                
+        except Exception as ex:
+            logging.exception('fail')
+            print(ex)
 
             
     def _handle_channel(self, dev, ch, msg_data):
         # Step 1: parse value
         if ch['parse'] == 'json':
-            value = json.loads(msg_data['raw_payload'])
+            # several channels can match the same message, so parse only once
+            if 'json' not in msg_data:
+                msg_data['json'] = json.loads(msg_data['raw_payload'])
+
+            value = msg_data['json']
         else:
             value = msg_data['raw_payload']
 
+        # arguments for all format strings of the channel
+        ctx = {'dev': dev, 'ch': ch, 'msg': msg_data, 'value': value}
+
         # Step 2: Extract value from payload (e.g. a specific value from JSON
         # structure) by string formatting
         try:
-            value = ch['value'].format(dev=dev, ch=ch, msg=msg_data, value=value)
+            value = ch['value'].format_map(ctx)
         except KeyError as k:
             msg = (
                 "Failed to process value access in device '{dev}', "
@@ -136,17 +239,24 @@ class TasmotaMQTTClient():
 
         # legacy
         msg_data['val'] = value
+        ctx['value'] = value
                 
-        bind_labels = {
-            k.format(dev=dev, ch=ch, msg=msg_data):
-            v.format(dev=dev, ch=ch, msg=msg_data)
-            for k,v in ch['labels'].items()}
-
-        measurement = ch['measurement'].format(
-            dev=dev,
-            ch=ch,
-            msg=msg_data,
-            value=value)
+        if ch['_label_keys'] is not None:
+            # label names are constant and already sorted
+            bind_labels = tuple(zip(
+                ch['_label_keys'],
+                [v.format_map(ctx) for v in ch['_label_val_fmts']]))
+        else:
+            # label names formatting to the same string are merged, the last
+            # one wins
+            bind_labels = {
+                k.format_map(ctx): v.format_map(ctx)
+                for k,v in ch['labels'].items()}
+            bind_labels = tuple(sorted(
+                bind_labels.items(),
+                key=itemgetter(0)))
+
+        measurement = ch['measurement'].format_map(ctx)
         
         self._prom_exp.set(
             name=measurement,
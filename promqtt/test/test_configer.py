@@ -0,0 +1,31 @@
+import argparse
+
+from promqtt.configer import eval_cfg
+
+
+CFG_DESC = {
+    'http.port': {
+        'type': int,
+        'help': 'TCP port for the http server.',
+        'default': 8086,
+    },
+    'http.interface': {
+        'type': str,
+        'help': 'Interface to bind the http server to.',
+        'default': '127.0.0.1',
+    },
+}
+
+
+def test_configer_env():
+    '''Environment variables override the defaults and are converted to the
+    configured type.'''
+
+    cfg = eval_cfg(
+        CFG_DESC,
+        cfg_in={},
+        env={'HTTP_PORT': '1234'},
+        args=argparse.Namespace())
+
+    assert(cfg['http']['port'] == 1234)
+    assert(cfg['http']['interface'] == '127.0.0.1')
@@ -1,7 +1,7 @@
 import pytest
 
 from promqtt.prom import PrometheusExporter, PrometheusExporterException
-from datetime import datetime, timedelta
+import time
 
 
 def _has_line(promexp, line):
@@ -66,7 +66,7 @@ def test_promqtt_set(promexp):
     promexp.set(
         name='test_meas_1',
         value=12.3,
-        labels={'foo': 'bar'})
+        labels=(('foo', 'bar'),))
 
     assert(_has_line(promexp, '# HELP test_meas_1 yeah'))
     assert(_has_line(promexp, '# TYPE test_meas_1 gauge'))
@@ -82,7 +82,7 @@ def test_promqtt_not_registered(promexp):
     promexp.set(
         name='test_meas_2',
         value=12.3,
-        labels={})
+        labels=())
 
     
 def test_promqtt_timeout(promexp):
@@ -97,20 +97,20 @@ def test_promqtt_timeout(promexp):
 
     # create dummy functions returning the current time or time 13s in the
     # future to fake timeout.
-    dt = datetime.now()
+    dt = time.monotonic()
 
     def tm_now():
         return dt
 
     def tm_13s():
-        return dt + timedelta(seconds=13)
+        return dt + 13
 
     promexp._get_time = tm_now
     
     promexp.set(
         name='test_meas_1',
         value=12.3,
-        labels={'foo': 'bar'})
+        labels=(('foo', 'bar'),))
 
     # make sure it is rendered to the output
     assert(_has_line(promexp, 'test_meas_1{foo="bar"} 12.3'))
@@ -123,3 +123,101 @@ def test_promqtt_timeout(promexp):
     # as there was only one item, also make sure that the header is removed
     assert(not _has_line(promexp, '# HELP yeah'))
     
+
+
+def test_promqtt_render_cache(promexp):
+    '''Rendered output is cached and updated after setting a new value.'''
+
+    promexp.register(
+        name='test_meas_1',
+        datatype='gauge',
+        helpstr='yeah',
+        timeout=12)
+
+    promexp.set(
+        name='test_meas_1',
+        value=12.3,
+        labels=(('foo', 'bar'),))
+
+    out = promexp.render_bytes()
+
+    # unchanged data returns the cached output
+    assert(promexp.render_bytes() is out)
+    assert(promexp.render() == out.decode('utf-8'))
+
+    promexp.set(
+        name='test_meas_1',
+        value=45.6,
+        labels=(('foo', 'bar'),))
+
+    assert(_has_line(promexp, 'test_meas_1{foo="bar"} 45.6'))
+    assert(not _has_line(promexp, 'test_meas_1{foo="bar"} 12.3'))
+
+
+def test_promqtt_set_none_removes(promexp):
+    '''Setting None as value removes only the addressed item.'''
+
+    promexp.register(
+        name='test_meas_1',
+        datatype='gauge',
+        helpstr='yeah',
+        timeout=12)
+
+    for node in ('a', 'b', 'c'):
+        promexp.set(
+            name='test_meas_1',
+            value=1,
+            labels=(('node', node),))
+
+    promexp.set(
+        name='test_meas_1',
+        value=None,
+        labels=(('node', 'a'),))
+
+    assert(not _has_line(promexp, 'test_meas_1{node="a"} 1'))
+    assert(_has_line(promexp, 'test_meas_1{node="b"} 1'))
+    assert(_has_line(promexp, 'test_meas_1{node="c"} 1'))
+
+    # update an item which was moved when removing the first one
+    promexp.set(
+        name='test_meas_1',
+        value=2,
+        labels=(('node', 'c'),))
+
+    assert(_has_line(promexp, 'test_meas_1{node="c"} 2'))
+
+
+def test_promqtt_timeout_partial(promexp):
+    '''Only the timed out items are removed, newer items are kept.'''
+
+    promexp.register(
+        name='test_meas_1',
+        datatype='gauge',
+        helpstr='yeah',
+        timeout=12)
+
+    dt = time.monotonic()
+
+    promexp._get_time = lambda: dt
+
+    promexp.set(
+        name='test_meas_1',
+        value=1,
+        labels=(('node', 'old'),))
+
+    promexp._get_time = lambda: dt + 6
+
+    promexp.set(
+        name='test_meas_1',
+        value=2,
+        labels=(('node', 'new'),))
+
+    promexp._get_time = lambda: dt + 13
+
+    assert(not _has_line(promexp, 'test_meas_1{node="old"} 1'))
+    assert(_has_line(promexp, 'test_meas_1{node="new"} 2'))
+    assert(_has_line(promexp, '# HELP test_meas_1 yeah'))
+
+    promexp._get_time = lambda: dt + 19
+
+    assert(not _has_line(promexp, 'test_meas_1{node="new"} 2'))
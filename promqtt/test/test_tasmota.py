@@ -0,0 +1,228 @@
+import json
+from unittest import mock
+
+import pytest
+
+from promqtt.prom import PrometheusExporter
+from promqtt.tasmota import TasmotaMQTTClient
+
+
+def _msg(topic, value):
+    '''Create a MQTT message with a JSON payload.'''
+
+    return mock.Mock(topic=topic, payload='{{"val": {0}}}'.format(value))
+
+
+def _has_line(pe, line):
+    '''Check if rendered output contains a specific line.'''
+
+    return line in pe.render().split('\n')
+
+
+def _channel(topic, labels=None):
+    '''Create a channel configuration reading a value from a JSON payload.'''
+
+    return {
+        'topic': topic,
+        'parse': 'json',
+        'measurement': 'test_meas',
+        'value': '{value[val]}',
+        'labels': labels if labels is not None else {},
+    }
+
+
+def _create_client(devices):
+    '''Create a client for the given devices (dict of device name to dict of
+    channels) without connecting to a MQTT broker and without starting the 
+    worker thread. Tests call `_handle_msg()` directly instead.
+
+    :returns: Tuple of client and prometheus exporter.'''
+
+    cfg = {
+        'measurements': {
+            'test_meas': {'type': 'gauge', 'help': 'test', 'timeout': None},
+        },
+        'types': {},
+        'devices': {
+            name: {'types': [], 'channels': channels}
+            for name, channels in devices.items()},
+    }
+
+    pe = PrometheusExporter()
+
+    with mock.patch('promqtt.tasmota.mqtt.Client'), \
+            mock.patch('promqtt.tasmota.Thread'):
+        tmc = TasmotaMQTTClient(
+            pe,
+            mqtt_cfg={'broker': 'mqtt', 'port': 1883},
+            cfg=cfg)
+
+    return tmc, pe
+
+
+def _found(tmc, topic):
+    '''Return the (device name, channel name) tuples matching the topic.'''
+
+    return sorted(
+        (dev['_dev_name'], ch['_ch_name'])
+        for dev, ch in tmc._find_channels(tuple(topic.split('/'))))
+
+
+@pytest.fixture
+def tmc():
+    '''Create a client with overlapping exact and wildcard channel topics.'''
+
+    tmc, pe = _create_client({
+        'dev_exact': {'state': _channel('tele/node1/STATE')},
+        'dev_wildcard': {'state': _channel('tele/+/STATE')},
+    })
+
+    return tmc
+
+
+def test_tasmota_topic_exact_and_wildcard(tmc):
+    '''Exact and wildcard channel topics both match the same message.'''
+
+    assert(_found(tmc, 'tele/node1/STATE') == [
+        ('dev_exact', 'state'),
+        ('dev_wildcard', 'state')])
+
+    assert(_found(tmc, 'tele/node2/STATE') == [
+        ('dev_wildcard', 'state')])
+
+
+def test_tasmota_topic_config_order():
+    '''Matching channels are returned in the order of the configuration.'''
+
+    topics = {
+        'dev_exact': 'tele/node1/STATE',
+        'dev_wildcard': 'tele/+/STATE',
+    }
+
+    for devices in (
+            ('dev_exact', 'dev_wildcard'),
+            ('dev_wildcard', 'dev_exact')):
+        tmc, pe = _create_client({
+            name: {'state': _channel(topics[name])} for name in devices})
+
+        found = tmc._find_channels(('tele', 'node1', 'STATE'))
+
+        assert(tuple(dev['_dev_name'] for dev, ch in found) == devices)
+
+
+def test_tasmota_topic_length_mismatch(tmc):
+    '''Topics with more or less parts than the channel topic do not match.'''
+
+    assert(_found(tmc, 'tele/node1') == [])
+    assert(_found(tmc, 'tele/node1/STATE/more') == [])
+
+
+def test_tasmota_topic_no_match(tmc):
+    '''Topics without matching channel yield nothing.'''
+
+    assert(_found(tmc, 'tele/node1/SENSOR') == [])
+    assert(_found(tmc, 'stat/node1/STATE') == [])
+
+
+def test_tasmota_unrelated_root_dropped(tmc):
+    '''Messages with a topic root not used by any channel are not queued.'''
+
+    tmc._queue = mock.Mock()
+
+    tmc.on_mqtt_msg(None, None, mock.Mock(topic='stat/node1/STATE'))
+    tmc._queue.put.assert_not_called()
+
+    msg = mock.Mock(topic='tele/node1/STATE')
+    tmc.on_mqtt_msg(None, None, msg)
+    tmc._queue.put.assert_called_once_with(msg)
+
+
+def test_tasmota_wildcard_root():
+    '''The topic root check is disabled if a channel topic starts with '+'.'''
+
+    tmc, pe = _create_client({
+        'dev_exact': {'state': _channel('tele/node1/STATE')},
+        'dev_wildcard': {'state': _channel('+/node1/STATE')},
+    })
+
+    assert(tmc._topic_roots is None)
+
+
+def test_tasmota_constant_labels_sorted():
+    '''Constant label names are sorted when loading the devices.'''
+
+    tmc, pe = _create_client({
+        'dev': {'state': _channel(
+            'tele/+/STATE',
+            labels={'sensor': 'bme280', 'node': '{msg[topic][1]}'})},
+    })
+
+    ch = tmc._cfg['devices']['dev']['channels']['state']
+    assert(ch['_label_keys'] == ('node', 'sensor'))
+
+    tmc._handle_msg(_msg('tele/node1/STATE', 12))
+
+    assert(_has_line(pe, 'test_meas{node="node1",sensor="bme280"} 12'))
+
+
+def test_tasmota_templated_labels_sorted():
+    '''Templated label names are sorted after formatting them.'''
+
+    tmc, pe = _create_client({
+        'dev': {'state': _channel(
+            'tele/+/STATE',
+            labels={'m': 'constant', '{msg[topic][1]}': 'templated'})},
+    })
+
+    ch = tmc._cfg['devices']['dev']['channels']['state']
+    assert(ch['_label_keys'] is None)
+
+    tmc._handle_msg(_msg('tele/a/STATE', 12))
+
+    assert(_has_line(pe, 'test_meas{a="templated",m="constant"} 12'))
+
+
+def test_tasmota_templated_labels_merged():
+    '''Label names formatting to the same string are merged, so the output
+    never contains duplicate label names.'''
+
+    tmc, pe = _create_client({
+        'dev': {'state': _channel(
+            'tele/+/STATE',
+            labels={'{msg[topic][1]}': 'x', 'node': 'y'})},
+    })
+
+    tmc._handle_msg(_msg('tele/node/STATE', 12))
+
+    assert(_has_line(pe, 'test_meas{node="y"} 12'))
+
+
+def test_tasmota_channel_without_labels():
+    '''Channels without labels are handled fine.'''
+
+    channel = _channel('tele/+/STATE')
+    del channel['labels']
+
+    tmc, pe = _create_client({'dev': {'state': channel}})
+
+    tmc._handle_msg(_msg('tele/node1/STATE', 12))
+
+    assert(_has_line(pe, 'test_meas{} 12'))
+
+
+def test_tasmota_json_parsed_once():
+    '''The payload is parsed only once for all channels matching a message.'''
+
+    tmc, pe = _create_client({
+        'dev': {
+            'ch_a': _channel('tele/+/STATE', labels={'ch': 'a'}),
+            'ch_b': _channel('tele/+/STATE', labels={'ch': 'b'}),
+        },
+    })
+
+    with mock.patch('promqtt.tasmota.json', wraps=json) as json_mock:
+        tmc._handle_msg(_msg('tele/node1/STATE', 12))
+
+    assert(json_mock.loads.call_count == 1)
+    assert(_has_line(pe, 'test_meas{ch="a"} 12'))
+    assert(_has_line(pe, 'test_meas{ch="b"} 12'))